@@ -1,35 +1,97 @@
-import json
+import asyncio
+import atexit
+import gzip
+import hashlib
+import importlib.util
 import logging
 import os
+import queue
 import time
 import re
+from array import array
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Literal
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+import httpx
+import orjson
+from pydantic import BaseModel
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
 
 # load api key from config file
 CONFIG_FILE = "config.json"
 try:
-    with open(CONFIG_FILE, "r") as f:
-        config = json.load(f)
+    with open(CONFIG_FILE, "rb") as f:
+        config = orjson.loads(f.read())
         API_KEY = config.get("GROQ_API_KEY")
         if not API_KEY:
             raise ValueError("Missing API key in config.json")
+        # optional: serve repeated prompts from an in-process cache (forces temperature 0)
+        CACHE_RESPONSES = config.get("CACHE_RESPONSES", False)
+        # optional: gzip large request bodies to Groq
+        COMPRESS_REQUESTS = config.get("COMPRESS_REQUESTS", False)
 except Exception as e:
     raise RuntimeError(f"Error loading config: {e}")
 
-# setup logging
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-log_filename = f"logs/session_{timestamp}.log"
-os.makedirs("logs", exist_ok=True)
-logging.basicConfig(
-    filename=log_filename, 
-    level=logging.INFO, 
-    format="%(asctime)s - %(levelname)s - %(message)s"
+# Groq request headers, built once; copy before adding per-request headers
+_HEADERS = {"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"}
+
+# Hand records to the listener unformatted, so %-formatting also happens off the request path
+class DeferredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+# setup logging: records are queued on the request path and written to the
+# session log file by a background listener thread
+def setup_logging():
+    root = logging.getLogger()
+    if root.handlers:  # already configured (e.g. on a Streamlit rerun)
+        return None
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    log_filename = f"logs/session_{timestamp}.log"
+    os.makedirs("logs", exist_ok=True)
+    file_handler = logging.FileHandler(log_filename)
+    file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)  # flush queued records on shutdown
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    # httpx/httpcore log every upstream call at INFO; keep those out of the session log
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("httpcore").setLevel(logging.WARNING)
+    return listener
+
+log_listener = setup_logging()
+
+# shared async HTTP client for Groq calls, created on FastAPI startup; HTTP/2 lets
+# concurrent completions multiplex over one connection (needs the h2 package)
+REQUEST_TIMEOUT = 60.0  # per connect/read/write, not for a whole streamed reply
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+client = None
+
+@asynccontextmanager
+async def lifespan(app):
+    global client
+    if not HTTP2_ENABLED:
+        logging.warning("h2 is not installed, falling back to HTTP/1.1 for Groq requests")
+    client = httpx.AsyncClient(
+        http2=HTTP2_ENABLED,
+        timeout=httpx.Timeout(REQUEST_TIMEOUT),
+        limits=httpx.Limits(max_connections=512, max_keepalive_connections=128)
     )
+    yield
+    await client.aclose()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
 # Define available models
@@ -41,124 +103,371 @@ AVAILABLE_MODELS = {
 }
 # Define thinking/reasoning models
 THINKING_MODELS = ["deepseek-r1-distill-qwen-32b"]
+MODEL_OPTIONS = list(AVAILABLE_MODELS)
+
+# Role codes used for the Streamlit chat history
+USER_ROLE, ASSISTANT_ROLE = 0, 1
+ROLE_NAMES = ("user", "assistant")
+
+# Serialize a Groq request body, gzip-compressing large ones when COMPRESS_REQUESTS is set
+GZIP_MIN_BYTES = 1024
+
+def encode_body(payload, headers):
+    body = orjson.dumps(payload)
+    if COMPRESS_REQUESTS and len(body) > GZIP_MIN_BYTES:
+        return gzip.compress(body, 1), {**headers, "Content-Encoding": "gzip"}
+    return body, headers
+
+# LRU cache of replies keyed by (model, messages), used when CACHE_RESPONSES is set
+RESPONSE_CACHE_SIZE = 1024
+response_cache = OrderedDict()
+
+def cache_key(model_name, messages):
+    return hashlib.blake2b(orjson.dumps([model_name, messages], option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+
+def cache_get(key, cache=response_cache):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def cache_put(key, value, cache=response_cache, max_size=RESPONSE_CACHE_SIZE):
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > max_size:
+        cache.popitem(last=False)
+
+# Pending upstream calls for cacheable requests, so concurrent identical
+# requests share one Groq completion instead of each issuing their own
+inflight = {}
+
+def resolve_inflight(key, pending, reply):
+    if pending is None:
+        return
+    if inflight.get(key) is pending:
+        del inflight[key]
+    if not pending.done():
+        pending.set_result(reply)
+
+# Only the most recent messages are sent to Groq; older ones are condensed into a
+# rolling summary by a small model, cached by the dropped prefix of the history.
+# Summaries are built in the background after a reply for the prefix the next turn
+# will drop, so the request path only reads the cache.
+MAX_HISTORY_MESSAGES = 20
+SUMMARY_MODEL = "llama-3.1-8b-instant"
+SUMMARY_CACHE_SIZE = 256
+SUMMARY_INPUT_CHARS = 24000  # keeps a cold-cache summary within the small model's context
+summary_cache = OrderedDict()
+summary_tasks = {}
+
+# Summary for a dropped prefix, falling back to the one from before its newest exchange
+def cached_summary(dropped):
+    summary = cache_get(cache_key(SUMMARY_MODEL, dropped), summary_cache)
+    if summary is None and len(dropped) > 2:
+        summary = cache_get(cache_key(SUMMARY_MODEL, dropped[:-2]), summary_cache)
+    return summary
+
+# Start summarizing the prefix the next turn will drop, once the history is long enough
+def schedule_summary(messages, reply):
+    history = messages + [{"role": "assistant", "content": reply}]
+    if len(history) <= MAX_HISTORY_MESSAGES:
+        return
+    dropped = history[:-MAX_HISTORY_MESSAGES]
+    key = cache_key(SUMMARY_MODEL, dropped)
+    if key in summary_cache or key in summary_tasks:
+        return
+    task = asyncio.create_task(summarize_history(dropped, key))
+    summary_tasks[key] = task
+    task.add_done_callback(lambda _: summary_tasks.pop(key, None))
+
+# Render messages for the summarizer, newest first until SUMMARY_INPUT_CHARS is used up
+def summary_transcript(messages):
+    lines = []
+    budget = SUMMARY_INPUT_CHARS
+    for m in reversed(messages):
+        line = f"{m['role']}: {m['content']}"
+        lines.append(line[:budget])
+        budget -= len(line)
+        if budget <= 0:
+            break
+    return "\n".join(reversed(lines))
+
+async def summarize_history(dropped, key):
+    # Fold the newest dropped exchange into the summary of everything before it when available
+    previous = cache_get(cache_key(SUMMARY_MODEL, dropped[:-2]), summary_cache) if len(dropped) > 2 else None
+    transcript = summary_transcript(dropped[-2:] if previous else dropped)
+    prompt = f"Summary so far: {previous}\n\nNew messages:\n{transcript}" if previous else transcript
+    payload = {
+        "model": SUMMARY_MODEL,
+        "messages": [
+            {"role": "system", "content": "Summarize this conversation in a few sentences, keeping any facts the user may refer back to."},
+            {"role": "user", "content": prompt},
+        ],
+        "temperature": 0,
+        "max_tokens": 256,
+    }
+    body, headers = encode_body(payload, _HEADERS)
+
+    try:
+        response = await client.post(GROQ_API_URL, content=body, headers=headers)
+        response.raise_for_status()
+        summary = orjson.loads(response.content)["choices"][0]["message"]["content"]
+    except (httpx.HTTPError, orjson.JSONDecodeError, KeyError, IndexError, TypeError) as e:
+        logging.warning("History summary failed: %s", e)
+        return
+    cache_put(key, summary, summary_cache, SUMMARY_CACHE_SIZE)
+
+# Terminal server-sent events: Groq ends a complete stream with [DONE]; /chat sends
+# the error event when the upstream stream breaks off, so clients never see a cut-off
+# reply as a finished one
+SSE_DONE = "[DONE]"
+SSE_ERROR_EVENT = 'event: error\ndata: {"error": "LLM stream interrupted"}\n\n'
+
+# Return the payload of a server-sent event "data:" line, or None for any other line
+def sse_data(line):
+    if not line.startswith("data:"):
+        return None
+    return line[len("data:"):].strip()
+
+# Extract the content delta from one server-sent event line of a streamed completion
+def parse_sse_delta(line):
+    data = sse_data(line)
+    if data is None or data == SSE_DONE:
+        return ""
+    # chunks without a content delta (role header, finish, usage, error) carry no text
+    try:
+        delta = orjson.loads(data)["choices"][0]["delta"]
+    except (orjson.JSONDecodeError, KeyError, IndexError, TypeError):
+        return ""
+    content = delta.get("content") if isinstance(delta, dict) else None
+    return content if isinstance(content, str) else ""
+
+# Replay a cached reply in the same SSE format as a streamed completion
+async def cached_stream(reply):
+    yield b"data: " + orjson.dumps({"choices": [{"delta": {"content": reply}}]}) + b"\n\n"
+    yield "data: [DONE]\n\n"
+
+# Request body for /chat
+class Msg(BaseModel):
+    role: Literal["user", "assistant", "system"]
+    content: str
+
+class ChatReq(BaseModel):
+    message: str = ""
+    history: list[Msg] = []
+    model: str = "llama-3.3-70b-versatile"
 
 @app.post("/chat")
-def chat(request: dict):
-    user_message = request.get("message")
-    chat_history = request.get("history", [])
-    model_name = request.get("model", "llama-3.3-70b-versatile")
+async def chat(req: ChatReq):
+    user_message = req.message
+    chat_history = [m.model_dump() for m in req.history]
+    model_name = req.model
     
     if not user_message:
         logging.warning("Received request with missing 'message'")
         raise HTTPException(status_code=400, detail="Missing 'message' in request")
 
     messages = chat_history + [{"role": "user", "content": user_message}]
-    
-    payload = {
-        "model": model_name,
-        "messages": messages,
-        "temperature": 0.7,
-    }
-    headers = {"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"}
 
+    # Cached replies are only reused for deterministic (temperature 0) completions
+    key = pending = None
+    if CACHE_RESPONSES:
+        key = cache_key(model_name, messages)
+        reply = cache_get(key)
+        if reply is not None:
+            logging.info("Model: %s | User: %s | Bot (cached): %s", model_name, user_message, reply)
+            schedule_summary(messages, reply)
+            return StreamingResponse(cached_stream(reply), media_type="text/event-stream")
+
+        # The owner always resolves the future (reply, or None on any failure or disconnect),
+        # and its upstream reads are bounded by the client timeout, so waiters need no deadline
+        # of their own; shield keeps a cancelled waiter from cancelling the shared future
+        pending = inflight.get(key)
+        if pending is not None:
+            reply = await asyncio.shield(pending)
+            if reply is None:
+                raise HTTPException(status_code=500, detail="Failed to fetch response from LLM")
+            logging.info("Model: %s | User: %s | Bot (coalesced): %s", model_name, user_message, reply)
+            schedule_summary(messages, reply)
+            return StreamingResponse(cached_stream(reply), media_type="text/event-stream")
+        pending = inflight[key] = asyncio.get_running_loop().create_future()
+
+    # Anything that stops this request before its stream starts must release the waiters
     try:
-        response = requests.post(GROQ_API_URL, json=payload, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        reply = data.get("choices", [{}])[0].get("message", {}).get("content", "No response")
-        logging.info(f"Model: {model_name} | User: {user_message} | Bot: {reply}")
-        return {"response": reply, "history": messages + [{"role": "assistant", "content": reply}]}
-    except requests.RequestException as e:
-        logging.error(f"API request failed: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch response from LLM")
+        # Trim long histories to the last MAX_HISTORY_MESSAGES, prefixed by a summary of the rest
+        prompt_messages = messages
+        if len(chat_history) > MAX_HISTORY_MESSAGES:
+            summary = cached_summary(chat_history[:-MAX_HISTORY_MESSAGES])
+            prompt_messages = messages[-(MAX_HISTORY_MESSAGES + 1):]
+            if summary:
+                prompt_messages = [{"role": "system", "content": f"Summary of the earlier conversation: {summary}"}] + prompt_messages
+    
+        payload = {
+            "model": model_name,
+            "messages": prompt_messages,
+            "temperature": 0 if CACHE_RESPONSES else 0.7,
+            "stream": True,
+        }
+        body, headers = encode_body(payload, _HEADERS)
+
+        try:
+            response = await client.send(
+                client.build_request("POST", GROQ_API_URL, content=body, headers=headers), stream=True
+            )
+        except httpx.HTTPError as e:
+            logging.error("API request failed: %s", e)
+            raise HTTPException(status_code=500, detail="Failed to fetch response from LLM")
+        if response.is_error:
+            await response.aclose()
+            logging.error("API request failed: %s %s", response.status_code, response.reason_phrase)
+            raise HTTPException(status_code=500, detail="Failed to fetch response from LLM")
+    except BaseException:
+        resolve_inflight(key, pending, None)
+        raise
+
+    # Forward the server-sent events as they arrive, collecting the reply for the log
+    async def stream_reply():
+        parts = []
+        completed = False
+        try:
+            async for line in response.aiter_lines():
+                parts.append(parse_sse_delta(line))
+                yield line + "\n"
+            completed = True
+        except httpx.HTTPError as e:
+            logging.error("API stream failed: %s", e)
+            yield SSE_ERROR_EVENT
+        finally:
+            await response.aclose()
+            resolve_inflight(key, pending, "".join(parts) if completed else None)
+        reply = "".join(parts)
+        if completed:
+            schedule_summary(messages, reply)
+        if completed and key is not None and reply:
+            cache_put(key, reply)
+        logging.info("Model: %s | User: %s | Bot: %s", model_name, user_message, reply)
+
+    # Runs after the response even if the client disconnected before the stream started
+    async def close_upstream():
+        await response.aclose()
+        resolve_inflight(key, pending, None)
+
+    return StreamingResponse(stream_reply(), media_type="text/event-stream", background=BackgroundTask(close_upstream))
+
+_THINK_RE = re.compile(r'<think>(.*?)</think>', re.DOTALL)
 
 # Function to process thinking model output
 def process_thinking_response(response):
-    think_pattern = r'<think>(.*?)</think>'
-    match = re.search(think_pattern, response, re.DOTALL)
+    # split alternates [outside, think, outside, think, ..., outside] in one scan
+    parts = _THINK_RE.split(response)
     
-    if match:
-        thinking = match.group(1).strip()
-        main_response = re.sub(think_pattern, '', response, flags=re.DOTALL).strip()
+    if len(parts) > 1:
+        thinking = parts[1].strip()
+        main_response = "".join(parts[0::2]).strip()
         return thinking, main_response
     
     return None, response
 
+# Keep-alive session for the Streamlit -> FastAPI calls, shared across reruns
+@st.cache_resource
+def get_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=Retry(total=2, backoff_factor=0.2))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Rebuild the chat history as the list of role/content messages the API expects
+def history_messages():
+    return [
+        {"role": ROLE_NAMES[role], "content": content}
+        for role, content in zip(st.session_state["roles"], st.session_state["contents"])
+    ]
+
 # Toggle thinking section
 def toggle_thinking(key):
     st.session_state["thinking_expanded"][key] = not st.session_state["thinking_expanded"].get(key, False)
 
+# Page styles, emitted on every rerun (Streamlit drops elements a rerun does not re-emit)
+_CSS = """
+<style>
+    body { color: white; }
+    .user-message {
+        background-color: #dcf8c6;
+        padding: 10px;
+        border-radius: 10px;
+        margin-bottom: 5px;
+        color: black;
+    }
+    .bot-message {
+        background-color: #f1f0f0;
+        padding: 10px;
+        border-radius: 10px;
+        margin-bottom: 5px;
+        color: black;
+    }
+    .thinking-section {
+        background-color: rgba(60, 60, 60, 0.2);
+        padding: 10px;
+        border-radius: 10px;
+        margin-bottom: 10px;
+        border-left: 3px solid #aaa;
+        color: #cccccc;
+        font-size: 0.9em;
+    }
+    .toggle-button {
+        background-color: transparent;
+        border: none;
+        color: #aaaaaa;
+        padding: 2px 8px;
+        text-align: left;
+        text-decoration: none;
+        display: inline-block;
+        font-size: 0.8em;
+        margin: 2px 0;
+        cursor: pointer;
+        border-radius: 4px;
+    }
+    .toggle-button:hover {
+        background-color: rgba(100, 100, 100, 0.2);
+        color: #ffffff;
+    }
+    .stTextInput, .stTextArea {
+        border-radius: 12px;
+        border: 1px solid #ccc;
+        padding: 10px;
+    }
+    .stButton>button {
+        width: 100%;
+        background-color: #4CAF50;
+        color: white;
+        font-size: 16px;
+        border-radius: 8px;
+        padding: 10px;
+    }
+    .stButton>button:hover {
+        background-color: #45a049;
+    }
+</style>
+"""
+
 # Streamlit UI
 def main():
     st.set_page_config(page_title="LLM Chatbot", page_icon="💬", layout="centered")
-    st.markdown("""
-        <style>
-            body { color: white; }
-            .user-message {
-                background-color: #dcf8c6;
-                padding: 10px;
-                border-radius: 10px;
-                margin-bottom: 5px;
-                color: black;
-            }
-            .bot-message {
-                background-color: #f1f0f0;
-                padding: 10px;
-                border-radius: 10px;
-                margin-bottom: 5px;
-                color: black;
-            }
-            .thinking-section {
-                background-color: rgba(60, 60, 60, 0.2);
-                padding: 10px;
-                border-radius: 10px;
-                margin-bottom: 10px;
-                border-left: 3px solid #aaa;
-                color: #cccccc;
-                font-size: 0.9em;
-            }
-            .toggle-button {
-                background-color: transparent;
-                border: none;
-                color: #aaaaaa;
-                padding: 2px 8px;
-                text-align: left;
-                text-decoration: none;
-                display: inline-block;
-                font-size: 0.8em;
-                margin: 2px 0;
-                cursor: pointer;
-                border-radius: 4px;
-            }
-            .toggle-button:hover {
-                background-color: rgba(100, 100, 100, 0.2);
-                color: #ffffff;
-            }
-            .stTextInput, .stTextArea {
-                border-radius: 12px;
-                border: 1px solid #ccc;
-                padding: 10px;
-            }
-            .stButton>button {
-                width: 100%;
-                background-color: #4CAF50;
-                color: white;
-                font-size: 16px;
-                border-radius: 8px;
-                padding: 10px;
-            }
-            .stButton>button:hover {
-                background-color: #45a049;
-            }
-        </style>
-    """, unsafe_allow_html=True)
+    st.markdown(_CSS, unsafe_allow_html=True)
     
     st.title("💬 Minimalist LLM Chatbot")
     st.write("Talk to the chatbot below.")
     
     # Initialize session state variables
-    if "chat_history" not in st.session_state:
-        st.session_state["chat_history"] = []
+    # Chat history is kept as parallel arrays: role codes and message contents
+    if "roles" not in st.session_state:
+        st.session_state["roles"] = array("b")
+        st.session_state["contents"] = []
+    if "models_used" not in st.session_state:
+        st.session_state["models_used"] = []  # model key per exchange
+    if "processed" not in st.session_state:
+        st.session_state["processed"] = []  # (thinking, main_response) per thinking-model exchange, else None
     if "user_input" not in st.session_state:
         st.session_state["user_input"] = ""
     if "selected_model" not in st.session_state:
@@ -171,7 +480,7 @@ def main():
         st.header("Model Selection")
         selected_model_display = st.selectbox(
             "Choose a model:",
-            options=list(AVAILABLE_MODELS.keys()),
+            options=MODEL_OPTIONS,
             index=0,
             key="model_selector"
         )
@@ -184,75 +493,114 @@ def main():
     # Display chat history
     chat_container = st.container()
     with chat_container:
-        # Group messages by conversation pairs
-        i = 0
-        while i < len(st.session_state["chat_history"]):
+        # Messages are collected as HTML and emitted in as few markdown calls as possible;
+        # only the thinking toggle buttons force a flush. Closing tags go on their own line
+        # after a blank one, so a message ending in a code fence or other block markdown
+        # ends cleanly instead of running into the next message's tags
+        parts = []
+        def flush():
+            if parts:
+                st.markdown("\n\n".join(parts), unsafe_allow_html=True)
+                parts.clear()
+        
+        contents = st.session_state["contents"]
+        models_used = st.session_state["models_used"]
+        processed = st.session_state["processed"]
+        for idx, (user_content, bot_content) in enumerate(zip(contents[0::2], contents[1::2])):
             # Display user message
-            if i < len(st.session_state["chat_history"]):
-                user_msg = st.session_state["chat_history"][i]
-                st.markdown(f'<div class="user-message"><b>You:</b> {user_msg["content"]}</div>', unsafe_allow_html=True)
-                i += 1
+            parts.append(f'<div class="user-message"><b>You:</b> {user_content}\n\n</div>')
             
-            # Display assistant message if available
-            if i < len(st.session_state["chat_history"]):
-                assistant_msg = st.session_state["chat_history"][i]
-                model_key = st.session_state.get(f"model_used_{i//2}", "Llama 3.3 70B")
+            # Display assistant message; thinking-model replies were split when they arrived
+            if AVAILABLE_MODELS[models_used[idx]] in THINKING_MODELS:
+                thinking, main_response = processed[idx]
+            else:
+                thinking, main_response = None, bot_content
+            
+            if thinking:
+                thinking_id = f"thinking_{2*idx + 1}"
+                flush()
                 
-                # Check if this is from a thinking model
-                if AVAILABLE_MODELS[model_key] in THINKING_MODELS:
-                    thinking, main_response = process_thinking_response(assistant_msg["content"])
-                    
-                    if thinking:
-                        thinking_id = f"thinking_{i}"
-                        
-                        # Use a proper button for toggle
-                        expanded = st.session_state["thinking_expanded"].get(thinking_id, False)
-                        toggle_text = "▶ Show thinking" if not expanded else "▼ Hide thinking"
-                        
-                        # Create a proper button with unique key
-                        if st.button(toggle_text, key=f"toggle_btn_{thinking_id}", on_click=toggle_thinking, args=(thinking_id,), type="secondary", help="Toggle thinking process"):
-                            pass  # The on_click handler takes care of the state change
-                        
-                        # Show thinking section if expanded
-                        if st.session_state["thinking_expanded"].get(thinking_id, False):
-                            st.markdown(f'<div class="thinking-section"><pre>{thinking}</pre></div>', unsafe_allow_html=True)
-                        
-                        # Show the main response
-                        st.markdown(f'<div class="bot-message"><b>Bot:</b> {main_response}</div>', unsafe_allow_html=True)
-                    else:
-                        st.markdown(f'<div class="bot-message"><b>Bot:</b> {assistant_msg["content"]}</div>', unsafe_allow_html=True)
-                else:
-                    st.markdown(f'<div class="bot-message"><b>Bot:</b> {assistant_msg["content"]}</div>', unsafe_allow_html=True)
-                i += 1
-    
-    # Create a callback that processes the input
-    def submit_message():
-        if st.session_state["user_input"].strip():
-            user_message = st.session_state["user_input"].strip()
-            model_key = st.session_state["selected_model"]
+                # Use a proper button for toggle
+                expanded = st.session_state["thinking_expanded"].get(thinking_id, False)
+                toggle_text = "▶ Show thinking" if not expanded else "▼ Hide thinking"
+                
+                # Create a proper button with unique key
+                if st.button(toggle_text, key=f"toggle_btn_{thinking_id}", on_click=toggle_thinking, args=(thinking_id,), type="secondary", help="Toggle thinking process"):
+                    pass  # The on_click handler takes care of the state change
+                
+                # Show thinking section if expanded
+                if st.session_state["thinking_expanded"].get(thinking_id, False):
+                    parts.append(f'<div class="thinking-section"><pre>{thinking}</pre>\n\n</div>')
+                
+                # Show the main response
+                parts.append(f'<div class="bot-message"><b>Bot:</b> {main_response}\n\n</div>')
+            else:
+                parts.append(f'<div class="bot-message"><b>Bot:</b> {bot_content}\n\n</div>')
+        flush()
+        
+        # Stream the reply to a just-submitted message below the history
+        pending = st.session_state.pop("pending_message", None)
+        if pending is not None:
+            user_message, model_key = pending
             model_name = AVAILABLE_MODELS[model_key]
+            st.markdown(f'<div class="user-message"><b>You:</b> {user_message}</div>', unsafe_allow_html=True)
             
             try:
                 with st.spinner("Thinking..."):
-                    response = requests.post(
+                    response = get_session().post(
                         "http://127.0.0.1:8000/chat", 
-                        json={
+                        data=orjson.dumps({
                             "message": user_message, 
-                            "history": st.session_state["chat_history"],
+                            "history": history_messages(),
                             "model": model_name
-                        }
+                        }),
+                        headers={"Content-Type": "application/json"},
+                        stream=True
                     )
-                    result = response.json()
-                    reply = result.get("response", "Error fetching response")
-                    
-                    # Store which model was used for this exchange
-                    conversation_index = len(st.session_state["chat_history"]) // 2
-                    st.session_state[f"model_used_{conversation_index}"] = model_key
-                    
-                    st.session_state["chat_history"].append({"role": "user", "content": user_message})
-                    st.session_state["chat_history"].append({"role": "assistant", "content": reply})
+
+                # The with block returns the connection to the session pool on every path
+                with response:
+                    response.raise_for_status()
+
+                    # Render tokens as they stream in
+                    placeholder = st.empty()
+                    reply = ""
+                    finished = False
+                    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                        if line.startswith("event: error"):
+                            break
+                        if sse_data(line) == SSE_DONE:
+                            finished = True
+                            break
+                        token = parse_sse_delta(line)
+                        if token:
+                            reply += token
+                            placeholder.markdown(f'<div class="bot-message"><b>Bot:</b> {reply}</div>', unsafe_allow_html=True)
             except requests.RequestException as e:
                 st.error(f"Request failed: {e}")
+            else:
+                if not finished:
+                    placeholder.empty()
+                    st.error("The response was interrupted before it finished. Please try again.")
+                else:
+                    reply = reply or "No response"
+
+                    # Store which model was used for this exchange, and split thinking-model
+                    # replies once, when they arrive
+                    st.session_state["models_used"].append(model_key)
+                    st.session_state["processed"].append(
+                        process_thinking_response(reply) if model_name in THINKING_MODELS else None
+                    )
+
+                    st.session_state["roles"].extend((USER_ROLE, ASSISTANT_ROLE))
+                    st.session_state["contents"].extend((user_message, reply))
+                    # Rerun so the new exchange is drawn by the history loop above
+                    st.rerun()
+    
+    # Create a callback that records the input; the reply is streamed in the script body
+    def submit_message():
+        if st.session_state["user_input"].strip():
+            st.session_state["pending_message"] = (st.session_state["user_input"].strip(), st.session_state["selected_model"])
 
     # Use a form to handle the input and submission
     with st.form(key="message_form", clear_on_submit=True):
@@ -266,4 +614,6 @@ if __name__ == "__main__":
     main()
 
 # To start FastAPI server, run:
-# python -m uvicorn chat_app:app --host 127.0.0.1 --port 8000 --reload
\ No newline at end of file
+# python -m uvicorn chat_app:app --host 127.0.0.1 --port 8000 --no-access-log --reload
+# (uvloop/httptools are used automatically where installed; app logging already
+# records each exchange, so the access log is disabled)
\ No newline at end of file